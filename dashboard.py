@@ -1,7 +1,14 @@
+import fnmatch
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
 
 try:
@@ -10,6 +17,26 @@ except ImportError:
     print("Streamlit is required. Install with: pip install streamlit")
     sys.exit(1)
 
+try:
+    from tsdownsample import MinMaxLTTBDownsampler
+except ImportError:
+    MinMaxLTTBDownsampler = None
+
+# read_excel(engine="calamine") needs pandas >= 2.2
+try:
+    import python_calamine  # noqa: F401
+    _PANDAS_VERSION = tuple(int(part) for part in pd.__version__.split(".")[:2])
+    EXCEL_ENGINE = "calamine" if _PANDAS_VERSION >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None  # pandas default (openpyxl for .xlsx)
+
+try:
+    import orjson  # noqa: F401
+    # Serializes NumPy arrays natively; used by st.plotly_chart and fig.to_html alike
+    pio.json.config.default_engine = "orjson"
+except ImportError:
+    pass
+
 # Configuration
 DATA_FOLDER = Path(__file__).resolve().parent
 FILE_PATTERNS = (
@@ -20,19 +47,130 @@ FILE_PATTERNS = (
     "Bhada Oscillation Data_*.csv",
     "Bhadla Oscillation Data_*.csv",
 )
+# Day-first STARTDATE layouts seen in SCADA exports, tried in order
+STARTDATE_FORMATS = (
+    "%d-%m-%Y %H:%M",
+    "%d-%m-%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+)
+# Only these columns are read from the source files
+REQUIRED_COLUMNS = ("STARTDATE", "HZ", "VPM")
+# Bump when the loader's output schema changes so old Parquet sidecars are ignored
+CACHE_VERSION = 3
+# Upper bound on points sent to the browser per trace
+MAX_PLOT_POINTS = 3000
+
+@st.cache_data(show_spinner=False, ttl=60)
+def _discover_files(dir_mtime_ns: int) -> list[Path]:
+    # Keyed on the folder's mtime so added/removed files invalidate it; one scandir
+    # matched against every pattern instead of a glob per pattern
+    with os.scandir(DATA_FOLDER) as entries:
+        files = [
+            Path(entry.path) for entry in entries
+            if entry.is_file() and any(fnmatch.fnmatch(entry.name, p) for p in FILE_PATTERNS)
+        ]
+    return sorted(files)
+
+def _cache_path(path: Path) -> Path:
+    # Parquet sidecar keyed on the source file's mtime and size, so edits invalidate it
+    stat = path.stat()
+    return path.with_suffix(
+        f"{path.suffix}.v{CACHE_VERSION}.{stat.st_mtime_ns}_{stat.st_size}.parquet"
+    )
+
+def _purge_stale_caches(path: Path, keep: Path) -> None:
+    for stale in path.parent.glob(f"{path.name}.*.parquet"):
+        if stale != keep:
+            stale.unlink(missing_ok=True)
 
-def _discover_files() -> list[Path]:
-    files: list[Path] = []
-    for pattern in FILE_PATTERNS:
-        files.extend(DATA_FOLDER.glob(pattern))
-    return sorted(set(files))
+def _precise_times(startdate: pd.Series) -> np.ndarray:
+    # Run-length encode the minute stamps in one sorted pass instead of two groupby scans.
+    # A stable argsort keeps the within-minute order identical to groupby().cumcount().
+    ts = startdate.to_numpy(dtype="datetime64[ns]").view(np.int64)
+    order = np.argsort(ts, kind="stable")
+    ts_sorted = ts[order]
+    starts = np.flatnonzero(np.diff(ts_sorted, prepend=ts_sorted[0] - 1))
+    counts = np.diff(np.append(starts, ts_sorted.size))
+
+    # Run lengths are small (~1200 at 20 Hz), so the divisor is stored in the narrowest
+    # dtype that fits; sample_idx stays int64 because it becomes the output buffer.
+    counts_narrow = counts.astype(np.min_scalar_type(counts.max()))
+    sample_idx = np.empty_like(ts)
+    samples_in_min = np.empty(ts.size, dtype=counts_narrow.dtype)
+    sample_idx[order] = np.arange(ts_sorted.size) - np.repeat(starts, counts)
+    samples_in_min[order] = np.repeat(counts_narrow, counts)
+
+    # Integer nanosecond math, in place: no float temporaries or to_timedelta round-trip
+    precise_ns = sample_idx
+    precise_ns *= 60_000_000_000
+    precise_ns //= samples_in_min
+    precise_ns += ts
+    return precise_ns.view("datetime64[ns]")
+
+def _is_required_column(name) -> bool:
+    # Match on the stripped header so "HZ " and " VPM" variants are still picked up
+    return str(name).strip() in REQUIRED_COLUMNS
+
+def _interpolate_gaps(y: np.ndarray) -> np.ndarray:
+    # Linear fill over valid positions; np.interp holds the end values, matching
+    # interpolate(limit_direction="both")
+    mask = np.isnan(y)
+    if not mask.any() or mask.all():
+        return y
+    valid = np.flatnonzero(~mask)
+    filled = y.copy()
+    filled[mask] = np.interp(np.flatnonzero(mask), valid, y[valid])
+    return filled
+
+def _parse_startdate(values: pd.Series, name: str) -> pd.Series:
+    # An explicit format skips pandas' per-row inference; cache=True parses each
+    # repeated minute string once.
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    text = values.astype("string").str.strip()
+    sample = text.dropna().head(20)
+    for fmt in STARTDATE_FORMATS:
+        try:
+            pd.to_datetime(sample, format=fmt)
+        except (ValueError, TypeError):
+            continue
+        parsed = pd.to_datetime(text, format=fmt, errors="coerce", cache=True)
+        # Rows in a different layout than the sample fall back to inference
+        unmatched = parsed.isna() & text.notna()
+        if unmatched.any():
+            print(f"{name}: {unmatched.sum()} STARTDATE values do not match {fmt!r}; inferring them")
+            parsed[unmatched] = pd.to_datetime(text[unmatched], errors="coerce", dayfirst=True)
+        return parsed
+    return pd.to_datetime(text, errors="coerce", dayfirst=True)
+
+def _read_csv(path: Path) -> pd.DataFrame:
+    # Multithreaded Arrow parser; STARTDATE stays text so pandas applies dayfirst parsing
+    convert_options = pacsv.ConvertOptions(
+        column_types={"STARTDATE": pa.string(), "HZ": pa.float32(), "VPM": pa.float32()},
+        include_columns=list(REQUIRED_COLUMNS),
+    )
+    try:
+        return pacsv.read_csv(path, convert_options=convert_options).to_pandas()
+    except (pa.ArrowInvalid, KeyError):
+        # Header name variants or non-numeric HZ/VPM cells: let pandas read and coerce it below
+        return pd.read_csv(path, usecols=_is_required_column)
 
 def _load_one_file(path: Path) -> pd.DataFrame | None:
     try:
+        cache_path = _cache_path(path)
+        if cache_path.exists():
+            try:
+                return pd.read_parquet(cache_path, engine="pyarrow")
+            except Exception as e:
+                print(f"Ignoring cache for {path.name}: {e}")
+
         if path.suffix.lower() in {".xlsx", ".xls"}:
-            df = pd.read_excel(path)
+            df = pd.read_excel(path, engine=EXCEL_ENGINE, usecols=_is_required_column)
         elif path.suffix.lower() == ".csv":
-            df = pd.read_csv(path)
+            df = _read_csv(path)
         else:
             return None
 
@@ -40,57 +178,135 @@ def _load_one_file(path: Path) -> pd.DataFrame | None:
         df.columns = df.columns.str.strip()
         
         # Validate required columns
-        required = ["STARTDATE", "HZ", "VPM"]
-        missing = [c for c in required if c not in df.columns]
+        missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
         if missing:
             print(f"Skipping {path.name}: missing columns {missing}")
             return None
 
         # 1. Convert timestamp to datetime
-        df["STARTDATE"] = pd.to_datetime(df["STARTDATE"], errors="coerce", dayfirst=True)
+        df["STARTDATE"] = _parse_startdate(df["STARTDATE"], path.name)
         df = df.dropna(subset=["STARTDATE"]).copy()
         if df.empty:
             print(f"Skipping {path.name}: no valid STARTDATE values")
             return None
 
-        # 2. Coerce numeric columns
-        df["HZ"] = pd.to_numeric(df["HZ"], errors="coerce")
-        df["VPM"] = pd.to_numeric(df["VPM"], errors="coerce")
+        # 2. Coerce numeric columns (float32 is ample precision and halves memory traffic)
+        df["HZ"] = pd.to_numeric(df["HZ"], errors="coerce").astype("float32")
+        df["VPM"] = pd.to_numeric(df["VPM"], errors="coerce").astype("float32")
         
         # 3. FIX: Distribute samples within the same minute
         # Spreads high-frequency (20Hz) samples evenly across the 60 seconds of each minute.
-        df['sample_idx'] = df.groupby('STARTDATE').cumcount()
-        df['samples_in_min'] = df.groupby('STARTDATE')['STARTDATE'].transform('count')
-        
-        df['PRECISE_TIME'] = df['STARTDATE'] + pd.to_timedelta(
-            (df['sample_idx'] / df['samples_in_min']) * 60, unit='s'
-        )
+        df['PRECISE_TIME'] = _precise_times(df['STARTDATE'])
+        # Sort once here so partitions and plots can rely on time order
+        df = df.sort_values("PRECISE_TIME", kind="mergesort").reset_index(drop=True)
 
         # 4. Data Cleaning - Handle missing values in HZ using linear interpolation
-        df["HZ"] = df["HZ"].interpolate(method="linear", limit_direction="both")
+        df["HZ"] = _interpolate_gaps(df["HZ"].to_numpy())
         df["SOURCE_FILE"] = path.stem
-        
-        return df.drop(columns=['sample_idx', 'samples_in_min'])
+
+        # 5. Cache the parsed result next to the source file for the next cold start
+        try:
+            df.to_parquet(cache_path, engine="pyarrow", compression="zstd")
+            _purge_stale_caches(path, keep=cache_path)
+        except Exception as e:
+            print(f"Could not cache {path.name}: {e}")
+
+        return df
     except Exception as e:
         print(f"Skipping {path.name}: {e}")
         return None
 
 @st.cache_data(show_spinner=False)
-def load_all_data() -> pd.DataFrame:
-    files = _discover_files()
+def load_all_data(files: tuple[Path, ...]) -> pd.DataFrame:
     if not files:
         return pd.DataFrame()
     
-    loaded = []
-    for f in files:
-        df_tmp = _load_one_file(f)
-        if df_tmp is not None and not df_tmp.empty:
-            loaded.append(df_tmp)
+    # Files are independent and most parsing runs in GIL-releasing native code
+    with ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+        loaded = [
+            df_tmp for df_tmp in executor.map(_load_one_file, files)
+            if df_tmp is not None and not df_tmp.empty
+        ]
     
-    return pd.concat(loaded, ignore_index=True) if loaded else pd.DataFrame()
+    if not loaded:
+        return pd.DataFrame()
+
+    return _concat_frames(loaded)
+
+def _concat_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    # Fill preallocated column buffers file by file instead of pd.concat. Each input is
+    # released from `frames` once copied (the caller's list is consumed), so peak memory
+    # shrinks towards the output alone. SOURCE_FILE is built directly as category codes.
+    lengths = [len(f) for f in frames]
+    bounds = np.cumsum([0, *lengths])
+    columns = [c for c in frames[0].columns if c != "SOURCE_FILE"]
+    names = [f["SOURCE_FILE"].iloc[0] for f in frames]
 
-def create_oscillation_plot(df: pd.DataFrame):
-    df_sorted = df.sort_values("PRECISE_TIME")
+    data = {
+        col: np.empty(bounds[-1], dtype=np.result_type(*(f[col].dtype for f in frames)))
+        for col in columns
+    }
+    for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        f, frames[i] = frames[i], None
+        for col in columns:
+            data[col][start:stop] = f[col].to_numpy()
+        del f
+
+    categories = list(dict.fromkeys(names))
+    codes = np.repeat([categories.index(n) for n in names], lengths)
+    data["SOURCE_FILE"] = pd.Categorical.from_codes(codes, categories=categories)
+    return pd.DataFrame(data, copy=False)
+
+@st.cache_resource(show_spinner=False)
+def partition_by_source(files: tuple[Path, ...]) -> dict[str, pd.DataFrame]:
+    # Keyed on the file list rather than the frame, so reruns neither hash nor unpickle
+    # the full dataset. cache_resource hands back the same dict without copying; treat
+    # the frames as read-only. Partitions are keyed on the file stem, so e.g. a .csv and
+    # an .xlsx of the same day share one and must be re-sorted together (once per fill).
+    df = load_all_data(files)
+    if df.empty:
+        return {}
+    return {
+        name: part.sort_values("PRECISE_TIME", kind="mergesort").reset_index(drop=True)
+        for name, part in df.groupby("SOURCE_FILE", sort=False, observed=True)
+    }
+
+def _gap_markers(valid: np.ndarray, min_len: int) -> np.ndarray:
+    # First index of every NaN run at least min_len samples long
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], ~valid, [0])).astype(np.int8)))
+    starts, ends = edges[::2], edges[1::2]
+    return starts[ends - starts >= min_len]
+
+def _downsample(x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # MinMaxLTTB keeps peaks and valleys while capping the number of plotted vertices
+    if MinMaxLTTBDownsampler is None or x.size <= MAX_PLOT_POINTS:
+        return x, y
+    valid = ~np.isnan(y)
+    if valid.all():
+        idx = MinMaxLTTBDownsampler().downsample(x.view(np.int64), y, n_out=MAX_PLOT_POINTS)
+        return x[idx], y[idx]
+
+    # VPM is not interpolated: downsample the valid samples only so NaNs can't skew the
+    # bucket extrema, then keep one NaN per outage wider than a bucket so Plotly still
+    # draws it as a gap
+    idx = np.flatnonzero(valid)
+    if idx.size > MAX_PLOT_POINTS:
+        idx = idx[MinMaxLTTBDownsampler().downsample(
+            x[idx].view(np.int64), y[idx], n_out=MAX_PLOT_POINTS
+        )]
+    idx = np.union1d(idx, _gap_markers(valid, min_len=x.size // MAX_PLOT_POINTS))
+    return x[idx], y[idx]
+
+def create_oscillation_plot(df: pd.DataFrame, webgl: bool = True):
+    # WebGL for the live chart; SVG for HTML exports, where WebGL doesn't embed cleanly
+    scatter = go.Scattergl if webgl else go.Scatter
+    # Downsampling needs time order; partitions are already sorted, so this is just a check
+    if not df["PRECISE_TIME"].is_monotonic_increasing:
+        df = df.sort_values("PRECISE_TIME", kind="mergesort")
+    # Plain ndarrays keep Plotly on its native datetime64/float encoding path
+    x = df["PRECISE_TIME"].to_numpy(dtype="datetime64[ns]")
+    hz_x, hz_y = _downsample(x, df["HZ"].to_numpy(dtype=np.float32))
+    vpm_x, vpm_y = _downsample(x, df["VPM"].to_numpy(dtype=np.float32))
 
     fig = make_subplots(
         rows=2, cols=1,
@@ -101,9 +317,9 @@ def create_oscillation_plot(df: pd.DataFrame):
 
     # Top Plot: HZ
     fig.add_trace(
-        go.Scatter(
-            x=df_sorted["PRECISE_TIME"],
-            y=df_sorted["HZ"],
+        scatter(
+            x=hz_x,
+            y=hz_y,
             name="Frequency (HZ)",
             line=dict(color="#00D4FF", width=1.2),
             hovertemplate="Time: %{x}<br>Freq: %{y:.4f} Hz<extra></extra>"
@@ -116,9 +332,9 @@ def create_oscillation_plot(df: pd.DataFrame):
 
     # Bottom Plot: VPM
     fig.add_trace(
-        go.Scatter(
-            x=df_sorted["PRECISE_TIME"],
-            y=df_sorted["VPM"],
+        scatter(
+            x=vpm_x,
+            y=vpm_y,
             name="VPM",
             line=dict(color="#FF4B4B", width=1.2),
             hovertemplate="Time: %{x}<br>VPM: %{y:.2f}<extra></extra>"
@@ -156,6 +372,25 @@ def create_oscillation_plot(df: pd.DataFrame):
     
     return fig
 
+def _hash_time_series(df: pd.DataFrame) -> tuple[int, int, int]:
+    # Length and time span identify a partition without hashing every row
+    if df.empty:
+        return (0, 0, 0)
+    return (len(df), df["PRECISE_TIME"].iloc[0].value, df["PRECISE_TIME"].iloc[-1].value)
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _hash_time_series})
+def build_plot(df: pd.DataFrame, name: str) -> go.Figure:
+    return create_oscillation_plot(df)
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: _hash_time_series})
+def build_html_export(df: pd.DataFrame, name: str) -> str:
+    # Convert an SVG version of the figure to an HTML string
+    return create_oscillation_plot(df, webgl=False).to_html(
+        include_plotlyjs='cdn', 
+        full_html=True, 
+        config={'displaylogo': False}
+    )
+
 def main():
     st.set_page_config(page_title="Bhadla Oscillation Analysis", layout="wide")
     
@@ -163,51 +398,55 @@ def main():
     st.markdown("This tool processes 20Hz sample data by interpolating sub-second timestamps for clear visualization.")
     
     with st.spinner("Processing data files..."):
-        df = load_all_data()
+        files = _discover_files(DATA_FOLDER.stat().st_mtime_ns)
+        partitions = partition_by_source(tuple(files))
 
-    if df.empty:
+    if not partitions:
         st.error("No data files found in the current directory.")
         return
 
     # Sidebar Filter & Export
     st.sidebar.header("Settings")
-    all_files = sorted(df["SOURCE_FILE"].unique())
+    all_files = sorted(partitions)
     selected_file = st.sidebar.selectbox("Select Data Source", all_files)
     
-    display_df = df[df["SOURCE_FILE"] == selected_file]
+    display_df = partitions[selected_file]
     
     # Generate the plot
-    fig = create_oscillation_plot(display_df)
+    fig = build_plot(display_df, selected_file)
     
     # 📥 DOWNLOAD SECTION in Sidebar
     st.sidebar.markdown("---")
     st.sidebar.subheader("Export Options")
     
-    # Convert figure to HTML string
-    html_content = fig.to_html(
-        include_plotlyjs='cdn', 
-        full_html=True, 
-        config={'displaylogo': False}
-    )
+    # The HTML export is only serialized on request. Session state remembers which
+    # (file, data) pair was prepared; the HTML itself lives in the build_html_export cache.
+    export_key = (selected_file, _hash_time_series(display_df))
+    if st.sidebar.button("Prepare HTML export"):
+        st.session_state["prepared_export"] = export_key
     
-    st.sidebar.download_button(
-        label="Download Plot as HTML",
-        data=html_content,
-        file_name=f"Bhadla_Analysis_{selected_file.split('.')[0]}.html",
-        mime="text/html",
-        help="Download an interactive version of this chart that opens in any browser."
-    )
+    if st.session_state.get("prepared_export") == export_key:
+        st.sidebar.download_button(
+            label="Download Plot as HTML",
+            data=build_html_export(display_df, selected_file),
+            file_name=f"Bhadla_Analysis_{selected_file.split('.')[0]}.html",
+            mime="text/html",
+            help="Download an interactive version of this chart that opens in any browser."
+        )
     
     # Main Dashboard Area
     st.plotly_chart(fig, use_container_width=True)
     
     # Statistics Summary
     st.markdown("### Signal Summary")
+    hz = display_df["HZ"].to_numpy()
+    hz_max = np.nanmax(hz)
+    hz_min = np.nanmin(hz)
     c1, c2, c3, c4 = st.columns(4)
-    c1.metric("Max Freq", f"{display_df['HZ'].max():.3f} Hz")
-    c2.metric("Min Freq", f"{display_df['HZ'].min():.3f} Hz")
-    c3.metric("Peak-to-Peak", f"{display_df['HZ'].max() - display_df['HZ'].min():.3f} Hz")
-    c4.metric("Total Samples", f"{len(display_df):,}")
+    c1.metric("Max Freq", f"{hz_max:.3f} Hz")
+    c2.metric("Min Freq", f"{hz_min:.3f} Hz")
+    c3.metric("Peak-to-Peak", f"{hz_max - hz_min:.3f} Hz")
+    c4.metric("Total Samples", f"{hz.size:,}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file